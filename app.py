@@ -2,17 +2,24 @@
 # This script is simple, correct, and matches the Dockerfile and requirements.
 
 import os
-import gc
+import atexit
+import shutil
+import hashlib
+import html
 import logging
+import signal
 import threading
 import time
-from datetime import datetime
 from collections import deque
-import base64
 
-from flask import Flask, Response
+import pybase64
+from flask import Flask, Response, request
+from waitress import serve
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.remote_connection import ChromeRemoteConnection
+from selenium.webdriver.common.driver_finder import DriverFinder
 from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -20,54 +27,157 @@ from selenium.webdriver.support import expected_conditions as EC
 # --- CONFIGURATION ---
 TARGET_URL = "https://bloxd.io"
 MAX_FAILURES = 5
+MAX_RESTART_DELAY_SECONDS = 600 # Ceiling for the exponential restart backoff
+HEALTHY_ITERATIONS_TO_RESET_BACKOFF = 10 # A session this long clears the restart backoff
 MAIN_LOOP_POLLING_INTERVAL_SECONDS = 30.0 # Take screenshot every 30 seconds
+SCREENSHOT_JPEG_QUALITY = 60
+PURGE_MEMORY_EVERY_N_SCREENSHOTS = 10 # Force a V8 GC + purge every ~5 minutes
+# Chrome's RSS creeps up over long sessions even without a leak on our side, so
+# restart it proactively. 120 iterations at 30s is about an hour per session;
+# a shorter polling interval means more iterations, so lower this to match.
+MAX_ITERATIONS_PER_DRIVER = 120
 
 # --- LOGGING ---
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
 # --- GLOBAL STATE ---
 driver = None
-BOT_STATE = { "status": "Initializing...", "start_time": datetime.now(), "event_log": deque(maxlen=20), "last_screenshot_base64": None }
-STATE_LOCK = threading.Lock()
+# One chromedriver process for the lifetime of the app; each restart only opens
+# a new browser session on it instead of forking a fresh chromedriver.
+_SERVICE = Service(executable_path=shutil.which("chromedriver"))
+
+class BotState:
+    """Shared bot state. Single-field stores and deque appends are atomic under the GIL, so no lock is needed."""
+    __slots__ = ('status', 'start_time', 'event_log', 'last_screenshot', 'last_screenshot_hash')
+
+    def __init__(self):
+        self.status = "Initializing..."
+        self.start_time = time.monotonic()
+        self.event_log = deque(maxlen=20)
+        self.last_screenshot = None
+        self.last_screenshot_hash = None # Hex blake2b of last_screenshot; doubles as its ETag
+
+STATE = BotState()
+SHUTDOWN = threading.Event() # Set on SIGTERM; wakes any pending wait immediately
 
 def log_event(message):
-    timestamp = datetime.now().strftime('%H:%M:%S')
-    full_message = f"[{timestamp}] {message}"
-    with STATE_LOCK:
-        BOT_STATE["event_log"].appendleft(full_message)
+    STATE.event_log.append((time.time(), message))
     logging.info(f"EVENT: {message}")
 
 # --- FLASK WEB SERVER ---
+HTML_TEMPLATE = """
+    <!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta http-equiv="refresh" content="30"><title>Bot Status</title><style>body{{font-family:monospace;background-color:#1e1e1e;color:#d4d4d4;display:flex;padding:1em;}} .content{{flex:1;padding-right:20px;}} .screenshot{{flex:1;}} h1,h2{{color:#569cd6;}} b{{color:#9cdcfe;}} pre{{white-space:pre-wrap;word-wrap:break-word;}} img{{border:2px solid #569cd6;max-width:100%;}}</style></head><body><div class="content"><h1>Bot Status</h1><p><b>Status:</b> {status}</p><p><b>Target:</b> {target}</p><p><b>Uptime:</b> {uptime}</p><h2>Event Log</h2><pre>{log}</pre></div><div class="screenshot"><h2>Browser View</h2>{img_tag}</div></body></html>
+    """
+SCREENSHOT_IMG_TAG = "<img src='/screenshot' alt='Browser Screenshot'>"
+NO_SCREENSHOT_TAG = "<p>No screenshot yet...</p>"
+
 flask_app = Flask('')
 @flask_app.route('/')
 def health_check():
-    with STATE_LOCK:
-        status = BOT_STATE['status']
-        uptime = str(datetime.now() - BOT_STATE['start_time']).split('.')[0]
-        event_log = list(BOT_STATE['event_log'])
-        screenshot_base64 = BOT_STATE['last_screenshot_base64']
-    html = f"""
-    <!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta http-equiv="refresh" content="30"><title>Bot Status</title><style>body{{font-family:monospace;background-color:#1e1e1e;color:#d4d4d4;display:flex;padding:1em;}} .content{{flex:1;padding-right:20px;}} .screenshot{{flex:1;}} h1,h2{{color:#569cd6;}} b{{color:#9cdcfe;}} pre{{white-space:pre-wrap;word-wrap:break-word;}} img{{border:2px solid #569cd6;max-width:100%;}}</style></head><body><div class="content"><h1>Bot Status</h1><p><b>Status:</b> {status}</p><p><b>Target:</b> {TARGET_URL}</p><p><b>Uptime:</b> {uptime}</p><h2>Event Log</h2><pre>{'<br>'.join(event_log)}</pre></div><div class="screenshot"><h2>Browser View</h2>{"<img src='data:image/png;base64,{screenshot_base64}' alt='Browser Screenshot'>" if screenshot_base64 else "<p>No screenshot yet...</p>"}</div></body></html>
-    """
-    return Response(html, mimetype='text/html')
+    status = STATE.status
+    start_time = STATE.start_time
+    event_log = list(reversed(STATE.event_log)) # Newest first; copied in one C call before formatting
+    has_screenshot = STATE.last_screenshot is not None
+    log_lines = [f"[{time.strftime('%H:%M:%S', time.localtime(t))}] {m}" for t, m in event_log]
+    minutes, seconds = divmod(int(time.monotonic() - start_time), 60)
+    hours, minutes = divmod(minutes, 60)
+    uptime = f"{hours}:{minutes:02}:{seconds:02}"
+    page = HTML_TEMPLATE.format_map({
+        "status": html.escape(status),
+        "target": TARGET_URL,
+        "uptime": uptime,
+        "log": '\n'.join(html.escape(line) for line in log_lines),
+        "img_tag": SCREENSHOT_IMG_TAG if has_screenshot else NO_SCREENSHOT_TAG,
+    })
+    return Response(page, mimetype='text/html')
+
+@flask_app.route('/screenshot')
+def screenshot():
+    # The bot loop stores the image before its hash, so reading the hash first can
+    # only pair an image with an older tag, which just costs the client a refetch.
+    etag = STATE.last_screenshot_hash
+    jpeg_bytes = STATE.last_screenshot
+    if jpeg_bytes is None:
+        return Response("No screenshot yet", status=404, mimetype='text/plain')
+    response = Response(jpeg_bytes, mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+    # Every dashboard refresh revalidates the image; answer 304 when it hasn't changed
+    if etag is not None:
+        response.set_etag(etag)
+    return response.make_conditional(request)
 
 # --- CORE BOT LOGIC ---
-def start_bot():
-    """Initializes the browser inside the Docker container."""
-    global driver
-    with STATE_LOCK:
-        BOT_STATE["status"] = "Starting Chrome..."
-    log_event("Attempting to start Selenium session with Chromium...")
+class SessionRecycle(Exception):
+    """Raised to tear down a healthy driver and start a fresh one."""
+
+def execute_cdp(cmd, params):
+    """Runs a Chrome DevTools Protocol command on the current session."""
+    return driver.execute("executeCdpCommand", {"cmd": cmd, "params": params})["value"]
+
+def service_running():
+    # Service only creates .process inside start()
+    process = getattr(_SERVICE, "process", None)
+    return process is not None and process.poll() is None
+
+def ensure_service_running(chrome_options):
+    """Starts the shared chromedriver on first use, or again if it has died."""
+    if not service_running():
+        if not _SERVICE.path:
+            # Not on PATH; fall back to the lookup webdriver.Chrome would do
+            _SERVICE.path = DriverFinder(_SERVICE, chrome_options).get_driver_path()
+        log_event(f"Starting chromedriver service ({_SERVICE.path})...")
+        _SERVICE.start()
+    return _SERVICE.service_url
 
+@atexit.register
+def stop_service():
+    if getattr(_SERVICE, "process", None) is not None:
+        _SERVICE.stop()
+
+def capture_screenshot():
+    """Captures the page as JPEG via CDP, which is far smaller than a PNG for UI screenshots."""
+    result = execute_cdp('Page.captureScreenshot', {'format': 'jpeg', 'quality': SCREENSHOT_JPEG_QUALITY})
+    # Decode the CDP payload once, with pybase64's SIMD decoder, straight to raw bytes
+    return pybase64.b64decode(result['data'])
+
+def purge_browser_memory():
+    """Asks V8 to collect garbage and release JS heap memory back to the OS."""
+    try:
+        execute_cdp('HeapProfiler.collectGarbage', {})
+        execute_cdp('Memory.forciblyPurgeJavaScriptMemory', {})
+    except WebDriverException as e:
+        log_event(f"Memory purge failed: {e.msg}")
+
+def setup_driver():
+    """Builds the Chromium options used for every browser session."""
     chrome_options = Options()
     chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1024,768")
+    # Keep Chromium's working set small for a long-running session
+    chrome_options.add_argument("--js-flags=--max-old-space-size=128 --max-semi-space-size=1")
+    # Cap renderers while keeping them out of the browser process (no --single-process)
+    chrome_options.add_argument("--renderer-process-limit=1")
+    chrome_options.add_argument("--process-per-site")
+    chrome_options.add_argument("--disable-features=Translate,BackForwardCache,OptimizationHints")
+    chrome_options.add_argument("--disable-background-networking")
+    chrome_options.add_argument("--disable-sync")
+    chrome_options.add_argument("--disable-default-apps")
+    chrome_options.add_argument("--disable-component-update")
+    return chrome_options
+
+def start_bot():
+    """Initializes the browser inside the Docker container."""
+    global driver
+    STATE.status = "Starting Chrome..."
+    log_event("Attempting to start Selenium session with Chromium...")
+    chrome_options = setup_driver()
     
-    log_event("Initializing webdriver.Chrome()...")
-    driver = webdriver.Chrome(options=chrome_options)
+    service_url = ensure_service_running(chrome_options)
+    log_event("Opening browser session on chromedriver...")
+    # ChromeRemoteConnection registers the goog/cdp endpoint that execute_cdp needs
+    driver = webdriver.Remote(command_executor=ChromeRemoteConnection(remote_server_addr=service_url), options=chrome_options)
     
     log_event("Navigating to URL...")
     driver.get(TARGET_URL)
@@ -77,40 +187,90 @@ def start_bot():
 
 def main_bot_loop():
     global driver
-    failure_count = 0
-    while failure_count < MAX_FAILURES:
+    failure_count = 0 # Failures since the last successful capture; stops the bot at MAX_FAILURES
+    restart_streak = 0 # Consecutive crash restarts; drives the backoff delay
+    while failure_count < MAX_FAILURES and not SHUTDOWN.is_set():
         try:
             start_bot()
-            with STATE_LOCK: BOT_STATE["status"] = "Running"
-            failure_count = 0 
+            STATE.status = "Running"
+            iteration = 0
             
-            while True:
-                time.sleep(MAIN_LOOP_POLLING_INTERVAL_SECONDS)
+            while not SHUTDOWN.wait(MAIN_LOOP_POLLING_INTERVAL_SECONDS):
                 log_event("Capturing screenshot...")
-                screenshot = driver.get_screenshot_as_base64()
-                with STATE_LOCK: BOT_STATE["last_screenshot_base64"] = screenshot
+                jpeg_bytes = capture_screenshot()
+                failure_count = 0
+                # Skip the store when the page hasn't changed since the last capture
+                screenshot_hash = hashlib.blake2b(jpeg_bytes, digest_size=16).hexdigest()
+                if screenshot_hash != STATE.last_screenshot_hash:
+                    STATE.last_screenshot = jpeg_bytes
+                    STATE.last_screenshot_hash = screenshot_hash
+                iteration += 1
+                if iteration == HEALTHY_ITERATIONS_TO_RESET_BACKOFF:
+                    restart_streak = 0
+                if iteration >= MAX_ITERATIONS_PER_DRIVER:
+                    raise SessionRecycle()
+                if iteration % PURGE_MEMORY_EVERY_N_SCREENSHOTS == 0:
+                    purge_browser_memory()
 
+        except SessionRecycle:
+            log_event(f"Recycling browser after {MAX_ITERATIONS_PER_DRIVER} iterations.")
+            STATE.status = "Recycling browser..."
         except Exception as e:
             failure_count += 1
+            restart_streak += 1
             log_event(f"CRITICAL ERROR (Failure #{failure_count}): {e}")
-            with STATE_LOCK: BOT_STATE["status"] = f"Crashed! Restarting... ({failure_count}/{MAX_FAILURES})"
+            STATE.status = f"Crashed! Restarting... ({failure_count}/{MAX_FAILURES})"
         finally:
             if driver:
                 try: driver.quit()
                 except Exception: pass
                 driver = None
-            gc.collect()
-            if failure_count < MAX_FAILURES:
-                log_event("Waiting 10s before restart...")
-                time.sleep(10)
+            if SHUTDOWN.is_set():
+                log_event("Shutdown requested, stopping bot loop.")
+                STATE.status = "STOPPED"
+                break
+            elif failure_count < MAX_FAILURES:
+                delay = min(MAX_RESTART_DELAY_SECONDS, 2 ** restart_streak)
+                log_event(f"Waiting {delay}s before restart...")
+                SHUTDOWN.wait(delay)
             else:
                 log_event(f"STOPPED after {MAX_FAILURES} failures.")
-                with STATE_LOCK: BOT_STATE["status"] = "STOPPED"
+                STATE.status = "STOPPED"
                 break
 
+_bot_thread = None
+_bot_thread_lock = threading.Lock()
+
+def start_bot_thread():
+    """Starts the bot loop once per process; later calls return the running thread."""
+    global _bot_thread
+    with _bot_thread_lock:
+        if _bot_thread is None:
+            log_event("Starting main bot loop in a background thread.")
+            _bot_thread = threading.Thread(target=main_bot_loop, daemon=True)
+            _bot_thread.start()
+        return _bot_thread
+
+def stop_bot_thread(timeout=30):
+    """Wakes the bot loop via SHUTDOWN and waits for it to quit the browser."""
+    SHUTDOWN.set()
+    if _bot_thread is not None:
+        _bot_thread.join(timeout=timeout)
+
+def handle_sigterm(signum, frame):
+    SHUTDOWN.set()
+    raise SystemExit(0)
+
+def main():
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    start_bot_thread()
+    # When run directly, serve the status page on a threaded WSGI server
+    # instead of Flask's single-threaded dev server.
+    port = int(os.environ.get("PORT", 8080))
+    try:
+        serve(flask_app, host='0.0.0.0', port=port, threads=4, _quiet=True)
+    finally:
+        stop_bot_thread()
+
 if __name__ == "__main__":
-    # Gunicorn runs this file, creating the flask_app instance.
-    # We must start the bot's main logic in a background thread.
-    log_event("Starting main bot loop in a background thread.")
-    bot_thread = threading.Thread(target=main_bot_loop, daemon=True)
-    bot_thread.start()
+    main()
@@ -0,0 +1,12 @@
+# Gunicorn imports app:flask_app without running app.main(), so the bot
+# loop has to be started from a worker hook instead.
+
+def post_worker_init(worker):
+    from app import start_bot_thread
+    start_bot_thread()
+
+def worker_exit(server, worker):
+    # Gunicorn handles SIGTERM itself, so app.handle_sigterm never runs here;
+    # set SHUTDOWN on worker exit so the bot loop quits Chrome cleanly.
+    from app import stop_bot_thread
+    stop_bot_thread()